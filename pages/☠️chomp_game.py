@@ -52,7 +52,7 @@ with cols[0]:
         key="chomp_n_rows_",
         label="Board rows",
         min_value=2,
-        max_value=4,
+        max_value=8,
         step=1,
         value=st.session_state.chomp["n_rows"],
         disabled=game_on or not end_status is None,
@@ -65,7 +65,7 @@ with cols[1]:
         key="chomp_n_cols_",
         label="Board columns",
         min_value=2,
-        max_value=6,
+        max_value=10,
         step=1,
         value=st.session_state.chomp["n_cols"],
         disabled=game_on or not end_status is None,
@@ -0,0 +1,190 @@
+from src.c4.c4_engine import MAX_DEPTH, THREADS, WIN_BASE, SolverProcess, build_server
+from statistics import mean, quantiles
+import argparse
+import json
+import platform
+import sys
+
+
+### -------------------------------------------------- ###
+### --- TEST POSITIONS ------------------------------- ###
+
+
+# Positions of the standard board, reached by random games where the player to move cannot win at once
+# Each comes with its exact score for the player to move, as in the C solver without WIN_BASE:
+# a win scores the number of own discs left after the winning one, plus one, a loss the opposite and a draw 0
+# The end and mid-game scores were checked against a plain negamax
+# The early-game positions are too deep for it, so they have no known score and only time the solver
+# They were kept among random games for taking at least 200k nodes to solve
+TEST_POSITIONS = {
+    "end": [
+        ("7577445752275465721432151644211", 4),
+        ("224317537341112562153354", 0),
+        ("54752742623275262377637556", -7),
+        ("4111755554222122724716146", 1),
+        ("3233462771714775724463423265342", -5),
+        ("3731364547265374527552217", -8),
+        ("25555153267352113732632277", 6),
+        ("167637545722664511157215541", 7),
+        ("15763364715357766565252164", -5),
+        ("313126732726711374417433671", 3),
+        ("776366172563617732763141", -9),
+        ("327351266646125534766455117774", -1),
+        ("7313165663771662413245346", 8),
+        ("4273313272736317414515237", -8),
+        ("5661311512333721661325637", -5),
+        ("21752111373141337666722423536", 1),
+        ("21224233223741333465515414", -2),
+        ("311246736354773116614212", -9),
+        ("716533473644214473466263162", -2),
+        ("715244334276142452316416227", -7),
+    ],
+    "mid": [
+        ("65445451661276333764", -11),
+        ("132333557752147741", 11),
+        ("61612534222441", 4),
+        ("14527471632337", 11),
+        ("4551255664521433163261", 3),
+        ("44771772456774564", -1),
+        ("15563376137436", -4),
+        ("477753223617657744", -4),
+        ("727737726715311222", 2),
+        ("67322735715136452", -12),
+        ("21166556667152", 9),
+        ("463747335477743256553", 10),
+        ("11656423525553433334", 10),
+        ("7233366415365176517", -11),
+        ("274163274231762224", 11),
+        ("3432116734634267545", -11),
+        ("723155414552757", -13),
+        ("711721522755225", -7),
+        ("11152647633714233", -1),
+        ("716447252645746", 2),
+    ],
+    "early": [
+        ("2646737732", None),
+        ("276512214", None),
+        ("6151231433", None),
+        ("455574262", None),
+        ("634134411", None),
+        ("156513565323", None),
+        ("2253334353", None),
+        ("561453771133", None),
+        ("7635662652642", None),
+        ("7145626234", None),
+    ],
+}
+
+
+def exact_score(score):
+    """Get the exact score from an evaluation of the solver, where unproven evaluations are taken as draws."""
+
+    if score >= WIN_BASE:
+        return score - WIN_BASE
+    if score <= -WIN_BASE:
+        return score + WIN_BASE
+
+    return 0
+
+
+### -------------------------------------------------- ###
+### --- BENCHMARK ------------------------------------ ###
+
+
+def bench_position(position, budget_ms, threads, repeat=1):
+    """
+    Solve a position with a new solver, so that the table starts empty and positions do not depend on each other.
+    The time is the best of the runs, as measured by the solver itself.
+
+    :param position: The sequence of moves played so far, as 1-based columns.
+    :param budget_ms: The time budget of the search in milliseconds, unlimited if 0.
+    :param threads: The number of threads of the search.
+    :param repeat: The number of timed runs.
+
+    :return: The statistics of the fastest run.
+    """
+
+    best = None
+    for _ in range(repeat):
+        solver = SolverProcess(threads=threads)
+        try:
+            stats = solver.search(position, budget_ms, MAX_DEPTH)
+        finally:
+            solver.stop()
+        if best is None or stats["elapsed_us"] < best["elapsed_us"]:
+            best = stats
+
+    return best
+
+
+def bench_tier(tier, budget_ms, threads, repeat=1):
+    """
+    Solve the test positions of a tier, and compare the scores to the known ones.
+    Positions without a known score are only timed, and left out of the correct count.
+
+    :param tier: The name of the tier, i.e. "end", "mid" or "early".
+    :param budget_ms: The time budget of each search in milliseconds, unlimited if 0.
+    :param threads: The number of threads of each search.
+    :param repeat: The number of timed runs of each position.
+
+    :return: A dictionary with the results.
+    """
+
+    times = []
+    nodes = 0
+    errors = []
+    for position, expected in TEST_POSITIONS[tier]:
+        stats = bench_position(position, budget_ms, threads, repeat)
+        times.append(stats["elapsed_us"] / 1e6)
+        nodes += stats["nodes"]
+
+        score = exact_score(stats["score"])
+        if expected is not None and score != expected:
+            errors.append({"position": position, "expected": expected, "score": score})
+
+    n_checked = sum(expected is not None for _, expected in TEST_POSITIONS[tier])
+    return {
+        "tier": tier,
+        "positions": len(TEST_POSITIONS[tier]),
+        "checked": n_checked,
+        "correct": n_checked - len(errors) if n_checked else None,
+        "mean_time": mean(times),
+        "p95_time": quantiles(times, n=20, method="inclusive")[18],
+        "nodes": nodes,
+        "nodes_per_second": nodes / sum(times) if sum(times) > 0 else 0,
+        "errors": errors,
+    }
+
+
+def bench_all(tiers, budget_ms=0, threads=THREADS, repeat=1):
+    """Benchmark the solver on the given tiers of test positions."""
+
+    build_server()
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "threads": threads,
+        "budget_ms": budget_ms,
+        "tiers": [bench_tier(tier, budget_ms, threads, repeat) for tier in tiers],
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the Connect-4 solver.")
+    parser.add_argument(
+        "--tiers", nargs="+", choices=list(TEST_POSITIONS), default=list(TEST_POSITIONS)
+    )
+    parser.add_argument("--budget-ms", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=THREADS)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="JSON file, stdout if not given")
+    args = parser.parse_args()
+
+    results = bench_all(args.tiers, args.budget_ms, args.threads, args.repeat)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,252 @@
+from src.c4.c4_engine import POOL_SIZE, WIN_BASE, get_pool
+from src.c4.c4_game import Connect4Bitboard
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import mmap
+import os
+import struct
+import threading
+
+
+BOOK_PATH = os.path.join(os.path.dirname(__file__), "book.bin")
+
+# Each record stores a position key, the best move as a 1-based column and its score
+# Scores of at least WIN_BASE in absolute value are proven, so the move is perfect, as in the C solver
+RECORD = struct.Struct("<QBh")
+
+# The book is built for the standard board, which the C solver plays on
+N_ROWS = 6
+N_COLS = 7
+
+
+### -------------------------------------------------- ###
+### --- POSITION KEYS -------------------------------- ###
+
+
+def play_moves(position):
+    """Play a sequence of moves, given as 1-based columns, from the empty board."""
+
+    state = Connect4Bitboard(N_ROWS, N_COLS)
+    for c in position:
+        state = state.add_disc(int(c) - 1, state.player)
+
+    return state
+
+
+def position_key(position):
+    """Get the same unique key as the C solver."""
+    return play_moves(position).key
+
+
+def mirror(position):
+    """Mirror the moves around the central column."""
+    return "".join(str(N_COLS + 1 - int(c)) for c in position)
+
+
+def canonical_key(position):
+    """
+    Get the key of a position, which is shared with its mirror image.
+
+    :param position: The sequence of moves played so far, as 1-based columns.
+
+    :return: A tuple with the smallest key of the position and its mirror, and whether the mirror was taken.
+    """
+
+    key = position_key(position)
+    mirror_key = position_key(mirror(position))
+
+    return (mirror_key, True) if mirror_key < key else (key, False)
+
+
+def is_won(position):
+    """Check whether the last move of the sequence completes 4 in a row."""
+
+    return play_moves(position).check_last_disc()
+
+
+### -------------------------------------------------- ###
+### --- OPENING BOOK --------------------------------- ###
+
+
+class OpeningBook:
+
+    def __init__(self, path=BOOK_PATH):
+
+        self.path = path
+
+        # Map the book in memory, so that only the records visited by a search are read
+        with open(self.path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) % RECORD.size != 0:
+            raise ValueError("Invalid book size.")
+
+        self.n_records = len(self.data) // RECORD.size
+
+    def __len__(self):
+        return self.n_records
+
+    def find(self, key):
+        """
+        Binary search a key among the records, which are sorted by key.
+
+        :param key: The canonical key of the position.
+
+        :return: A tuple with the 1-based column stored for the key and its score, or None if missing.
+        """
+
+        lo, hi = 0, self.n_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, col, score = RECORD.unpack_from(self.data, mid * RECORD.size)
+            if k == key:
+                return col, score
+            if k < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return None
+
+    def entry(self, position):
+        """
+        Get the book move at the given position, with its score.
+
+        :param position: The sequence of moves played so far, as 1-based columns.
+
+        :return: A tuple with the 1-based column where to drop the disc and its score for the player to move, or None if the position is not in the book.
+        """
+
+        key, mirrored = canonical_key(position)
+        record = self.find(key)
+        if record is None:
+            return None
+
+        # The move was stored for the mirror image, which has the same score
+        col, score = record
+        return (N_COLS + 1 - col if mirrored else col), score
+
+    def move(self, position):
+        """Get the book move at the given position, or None if the position is not in the book."""
+
+        entry = self.entry(position)
+        return None if entry is None else entry[0]
+
+
+book = None
+book_lock = threading.Lock()
+
+
+def get_book():
+    """Get the opening book of the process, loading it at first call, or None if it was never built."""
+
+    global book
+    with book_lock:
+        if book is None and os.path.exists(BOOK_PATH):
+            book = OpeningBook()
+
+    return book
+
+
+### -------------------------------------------------- ###
+### --- BOOK GENERATION ------------------------------ ###
+
+
+def enumerate_positions(max_ply):
+    """
+    Enumerate all positions reachable in up to max_ply moves, where the game is not over.
+    Positions are merged with their mirror image, which is stored in its canonical orientation.
+
+    :param max_ply: The maximum number of moves played.
+
+    :return: A dictionary mapping the canonical keys to move sequences.
+    """
+
+    positions = dict()
+    frontier = [""]
+    for ply in range(max_ply + 1):
+        next_frontier = []
+        for position in frontier:
+            key, mirrored = canonical_key(position)
+            if key in positions:
+                continue
+            positions[key] = mirror(position) if mirrored else position
+
+            if ply == max_ply:
+                continue
+            for col in range(1, N_COLS + 1):
+                child = position + str(col)
+                if child.count(str(col)) <= N_ROWS and not is_won(child):
+                    next_frontier.append(child)
+        frontier = next_frontier
+
+    return positions
+
+
+def build_book(max_ply, budget_ms, proven_only=False):
+    """
+    Search the best move of every position up to the given ply.
+    Searches are spread over the pool of solver servers.
+    Moves are perfect when their score is proven, which an unlimited budget always gives.
+
+    :param max_ply: The maximum number of moves played.
+    :param budget_ms: The time budget of each search in milliseconds, unlimited if 0.
+    :param proven_only: Whether to drop the positions whose score is not proven within the budget.
+
+    :return: A dictionary mapping the canonical keys to tuples of the best 1-based column and its score.
+    """
+
+    positions = enumerate_positions(max_ply)
+    pool = get_pool()
+
+    with ThreadPoolExecutor(max_workers=POOL_SIZE) as executor:
+        results = executor.map(
+            lambda position: pool.search(position, budget_ms), positions.values()
+        )
+        moves = {
+            key: (result["move"], result["score"])
+            for key, result in zip(positions.keys(), results)
+        }
+
+    if proven_only:
+        moves = {key: entry for key, entry in moves.items() if is_proven(entry[1])}
+
+    return moves
+
+
+def is_proven(score):
+    """Check whether a score is a proven win or loss, rather than a heuristic evaluation."""
+    return abs(score) >= WIN_BASE
+
+
+def write_book(moves, path=BOOK_PATH):
+    """Save the moves and their scores to a book file, sorted by key."""
+
+    with open(path, "wb") as f:
+        for key in sorted(moves):
+            f.write(RECORD.pack(key, *moves[key]))
+
+
+### -------------------------------------------------- ###
+### --- OFFLINE SOLVER ------------------------------- ###
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Precompute the Connect-4 opening book.")
+    parser.add_argument("--max-ply", type=int, default=8)
+    parser.add_argument("--budget-ms", type=int, default=2000)
+    parser.add_argument("--output", default=BOOK_PATH)
+    parser.add_argument(
+        "--proven-only", action="store_true", help="Drop the moves whose score is not proven"
+    )
+    args = parser.parse_args()
+
+    moves = build_book(args.max_ply, args.budget_ms, args.proven_only)
+    write_book(moves, args.output)
+    n_unproven = sum(not is_proven(score) for _, score in moves.values())
+    print(
+        "Saved {} positions to {}, {} of them unproven".format(
+            len(moves), args.output, n_unproven
+        )
+    )
@@ -0,0 +1,328 @@
+import atexit
+import ctypes
+import json
+import os
+import queue
+import subprocess
+import threading
+
+
+C4_DIR = os.path.dirname(__file__)
+SOURCE_PATH = os.path.join(C4_DIR, "c4_minimax.c")
+
+# Number of solver servers, each answering one request at a time
+POOL_SIZE = min(4, os.cpu_count() or 1)
+
+# Number of threads of each search, so that busy servers share the cores
+THREADS = max(1, (os.cpu_count() or 1) // POOL_SIZE)
+
+# Searches stop at the end of the game unless a lower depth is given
+# The solver caps the depth at the number of empty cells, so this covers any board
+MAX_DEPTH = 255
+
+# Scores of at least WIN_BASE in absolute value are proven wins or losses, as in the C solver
+WIN_BASE = 1000
+
+# Backend of the bot, either "pool" for the solver servers or "native" for the solver loaded in-process
+# The in-process solver skips the pipes, but runs one search at a time and shares the crashes of the app
+BACKEND = os.environ.get("C4_BACKEND", "pool")
+
+
+### -------------------------------------------------- ###
+### --- BUILD ---------------------------------------- ###
+
+
+def check_size(n_rows, n_cols):
+    """Check that the C solver supports the board size, i.e. moves are single digits and the board fits 128 bits."""
+
+    if n_rows < 1 or not 1 <= n_cols <= 9 or (n_rows + 1) * n_cols > 128:
+        raise ValueError(
+            "Unsupported board size {}x{} for the C solver.".format(n_rows, n_cols)
+        )
+
+
+def library_path(n_rows, n_cols):
+    return os.path.join(C4_DIR, "libc4_{}x{}.so".format(n_rows, n_cols))
+
+
+def server_path(n_rows, n_cols):
+    return os.path.join(C4_DIR, "c4_minimax_{}x{}".format(n_rows, n_cols))
+
+
+def build(target, n_rows, n_cols, flags):
+    """
+    Compile the C solver for a board size, if not compiled since its last change.
+    The size is fixed at compile time, so that each size gets its own constants and bitboard width.
+
+    :param target: The path of the compiled file.
+    :param n_rows: The number of rows of the board.
+    :param n_cols: The number of columns of the board.
+    :param flags: The compiler flags specific to the target.
+    """
+
+    check_size(n_rows, n_cols)
+
+    # Skip the build if the target is newer than the source
+    if os.path.exists(target):
+        if os.path.getmtime(target) >= os.path.getmtime(SOURCE_PATH):
+            return
+
+    command = [
+        os.environ.get("CC", "cc"),
+        "-O2",
+        "-pthread",
+        "-DROWS={}".format(n_rows),
+        "-DCOLS={}".format(n_cols),
+        *flags,
+        "-o",
+        target,
+        SOURCE_PATH,
+    ]
+    subprocess.run(command, capture_output=True, check=True)
+
+
+def build_library(n_rows=6, n_cols=7):
+    """Compile the C solver into a shared library."""
+    build(library_path(n_rows, n_cols), n_rows, n_cols, ["-shared", "-fPIC", "-DC4_LIBRARY"])
+
+
+def build_server(n_rows=6, n_cols=7):
+    """Compile the C solver into an executable, which can serve requests."""
+    build(server_path(n_rows, n_cols), n_rows, n_cols, [])
+
+
+### -------------------------------------------------- ###
+### --- NATIVE LIBRARY ------------------------------- ###
+
+
+class SearchStats(ctypes.Structure):
+
+    # Same layout as SearchStats in the C solver
+    _fields_ = [
+        ("score", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("nodes", ctypes.c_uint64),
+        ("tt_hits", ctypes.c_uint64),
+        ("cutoffs", ctypes.c_uint64),
+        ("elapsed_us", ctypes.c_uint64),
+    ]
+
+
+class NativeEngine:
+
+    def __init__(self, n_rows=6, n_cols=7, threads=THREADS):
+
+        # Load the solver once, so that a move only costs the search
+        build_library(n_rows, n_cols)
+        self.lib = ctypes.CDLL(library_path(n_rows, n_cols))
+        self.lib.solve.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+        self.lib.solve.restype = ctypes.c_int
+        self.lib.set_threads.argtypes = [ctypes.c_int]
+        self.lib.set_threads(threads)
+        self.lib.get_stats.argtypes = [ctypes.POINTER(SearchStats)]
+        self.lib.get_stats.restype = None
+
+        # The library is not meant to run concurrent searches
+        self.lock = threading.Lock()
+
+    def search(self, position, budget_ms, depth=MAX_DEPTH):
+        """
+        Search the best move at the given position.
+        The search deepens iteratively until the time budget is over.
+
+        :param position: The sequence of moves played so far, as 1-based columns.
+        :param budget_ms: The time budget of the search in milliseconds, unlimited if 0.
+        :param depth: The maximum depth of the search.
+
+        :return: A dictionary with the 1-based column where to drop the disc as "move", None if the position is invalid, and the statistics of the search.
+        """
+
+        stats = SearchStats()
+        with self.lock:
+            col = self.lib.solve(position.encode(), depth, budget_ms)
+            self.lib.get_stats(ctypes.byref(stats))
+
+        result = {"move": col if col > 0 else None}
+        result.update({name: getattr(stats, name) for name, _ in stats._fields_})
+        return result
+
+    def best_move(self, position, budget_ms, depth=MAX_DEPTH):
+        """Get the best move at the given position, as in search."""
+        return self.search(position, budget_ms, depth)["move"]
+
+
+### -------------------------------------------------- ###
+### --- SOLVER SERVERS ------------------------------- ###
+
+
+class SolverProcess:
+
+    def __init__(self, n_rows=6, n_cols=7, threads=THREADS):
+
+        # Keep a solver running and talk to it through its standard streams
+        # The process lives across moves and games, so its state stays warm
+        self.path = server_path(n_rows, n_cols)
+        self.threads = threads
+        self.process = None
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.path, "--serve", str(self.threads), "--stats"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+    def search(self, position, budget_ms, depth=MAX_DEPTH):
+        """
+        Search the best move at the given position with the running solver.
+        If the solver died, it is restarted and the request is sent again.
+
+        :param position: The sequence of moves played so far, as 1-based columns.
+        :param budget_ms: The time budget of the search in milliseconds, unlimited if 0.
+        :param depth: The maximum depth of the search.
+
+        :return: A dictionary with the 1-based column where to drop the disc as "move", None if the position is invalid, and the statistics of the search.
+        """
+
+        for attempt in range(2):
+            try:
+                self.process.stdin.write(
+                    "{} {} {}\n".format(depth, budget_ms, position)
+                )
+                result = json.loads(self.process.stdout.readline())
+                if result["move"] <= 0:
+                    result["move"] = None
+                return result
+            except (OSError, ValueError):
+                if attempt > 0:
+                    raise
+                self.process.kill()
+                self.start()
+
+    def best_move(self, position, budget_ms, depth=MAX_DEPTH):
+        """Get the best move at the given position, as in search."""
+        return self.search(position, budget_ms, depth)["move"]
+
+
+class SolverPool:
+
+    def __init__(self, size, n_rows=6, n_cols=7):
+
+        # Idle solvers wait in a queue, so that each request is served by a single solver
+        # When all solvers are busy, requests wait for the first one to be released
+        self.solvers = queue.Queue()
+        for _ in range(size):
+            self.solvers.put(SolverProcess(n_rows, n_cols))
+
+    def search(self, position, budget_ms, depth=MAX_DEPTH):
+        """
+        Search the best move at the given position with the first idle solver.
+
+        :param position: The sequence of moves played so far, as 1-based columns.
+        :param budget_ms: The time budget of the search in milliseconds, unlimited if 0.
+        :param depth: The maximum depth of the search.
+
+        :return: A dictionary with the 1-based column where to drop the disc as "move", None if the position is invalid, and the statistics of the search.
+        """
+
+        solver = self.solvers.get()
+        try:
+            return solver.search(position, budget_ms, depth)
+        finally:
+            self.solvers.put(solver)
+
+    def best_move(self, position, budget_ms, depth=MAX_DEPTH):
+        """Get the best move at the given position, as in search."""
+        return self.search(position, budget_ms, depth)["move"]
+
+    def close(self):
+        while not self.solvers.empty():
+            self.solvers.get().stop()
+
+
+### -------------------------------------------------- ###
+### --- BATCH ANALYSIS ------------------------------- ###
+
+
+def analyse(positions, budget_ms, depth=MAX_DEPTH, n_rows=6, n_cols=7, threads=THREADS):
+    """
+    Analyse many positions with a single solver process, which keeps its table across them.
+    This pays the start of the solver once, and positions of the same game share their work.
+
+    :param positions: The positions, each as the sequence of moves played so far as 1-based columns.
+    :param budget_ms: The time budget of each search in milliseconds, unlimited if 0.
+    :param depth: The maximum depth of each search.
+    :param n_rows: The number of rows of the board.
+    :param n_cols: The number of columns of the board.
+    :param threads: The number of threads of each search.
+
+    :return: A generator of (move, score, nodes) tuples in the order of the positions, where move is None if the position is invalid or blank.
+    """
+
+    build_server(n_rows, n_cols)
+    command = [server_path(n_rows, n_cols), "--batch", str(depth), str(budget_ms), "-", str(threads)]
+
+    with subprocess.Popen(
+        command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    ) as process:
+
+        # Feed the positions from a thread, while the results are read as they come
+        def feed():
+            for position in positions:
+                process.stdin.write(position + "\n")
+            process.stdin.close()
+
+        threading.Thread(target=feed, daemon=True).start()
+        for line in process.stdout:
+            move, score, nodes = map(int, line.split())
+            yield (move if move > 0 else None), score, nodes
+
+
+### -------------------------------------------------- ###
+### --- ENGINE INSTANCES ----------------------------- ###
+
+
+# Engines and pools by board size
+engines = dict()
+pools = dict()
+instance_lock = threading.Lock()
+
+
+def get_engine(n_rows=6, n_cols=7):
+    """Get the in-process engine for a board size, loading it at first call."""
+
+    with instance_lock:
+        if (n_rows, n_cols) not in engines:
+            engines[n_rows, n_cols] = NativeEngine(n_rows, n_cols)
+
+    return engines[n_rows, n_cols]
+
+
+def get_pool(n_rows=6, n_cols=7):
+    """Get the pool of solver servers of the process for a board size, starting it at first call."""
+
+    with instance_lock:
+        if (n_rows, n_cols) not in pools:
+            build_server(n_rows, n_cols)
+            pool = SolverPool(POOL_SIZE, n_rows, n_cols)
+            atexit.register(pool.close)
+            pools[n_rows, n_cols] = pool
+
+    return pools[n_rows, n_cols]
+
+
+def get_backend(n_rows=6, n_cols=7):
+    """Get the engine searching the bot's moves for a board size, as chosen by BACKEND."""
+
+    if BACKEND == "native":
+        return get_engine(n_rows, n_cols)
+
+    return get_pool(n_rows, n_cols)
@@ -1,9 +1,10 @@
+from functools import lru_cache
 import numpy as np
 
 
 class Connect4State:
 
-    def __init__(self, n_rows, n_cols, board=None):
+    def __init__(self, n_rows, n_cols, board=None, last=None):
 
         # Store board variables
         self.n_rows = n_rows
@@ -14,6 +15,8 @@ class Connect4State:
             if board is not None
             else np.zeros((self.n_rows, self.n_cols), dtype=int)
         )
+        # Keep the cell of the last disc added, as only lines through it can be new
+        self.last = last
 
     def __str__(self):
 
@@ -51,7 +54,12 @@ class Connect4State:
         # Return the new state
         # Storing all children for all states would be too memory-intensive and with redundant information
         # This is not properly a tree, but it acts as such
-        return Connect4State(n_rows=self.n_rows, n_cols=self.n_cols, board=board_n)
+        return Connect4State(
+            n_rows=self.n_rows,
+            n_cols=self.n_cols,
+            board=board_n,
+            last=(idx_r, idx_c),
+        )
 
     def check_win(self, player):
         """
@@ -62,30 +70,67 @@ class Connect4State:
         """
 
         n_rows, n_cols = self.n_rows, self.n_cols
+        discs = self.board == player
+
+        # Each window of 4 cells is identified by its first cell
+        # Then, shifting the board by 0 to 3 cells along a direction and taking the and gives all windows at once
+        # Windows only fit if the board is at least 4 cells long in the directions moved along
+        if n_cols >= 4:
+            # Check horizontal alignments
+            if np.logical_and.reduce(
+                [discs[:, i : n_cols - 3 + i] for i in range(4)]
+            ).any():
+                return True
+
+        if n_rows >= 4:
+            # Check vertical alignments
+            if np.logical_and.reduce(
+                [discs[i : n_rows - 3 + i, :] for i in range(4)]
+            ).any():
+                return True
 
-        # Check horizontal alignments
-        for row in range(n_rows):
-            for col in range(n_cols - 3):
-                if np.all(self.board[row, col : col + 4] == player):
-                    return True
-
-        # Check vertical alignments
-        for col in range(n_cols):
-            for row in range(n_rows - 3):
-                if np.all(self.board[row : row + 4, col] == player):
-                    return True
-
-        # Check main diagonals
-        for row in range(n_rows - 3):
-            for col in range(n_cols - 3):
-                if all(self.board[row + i, col + i] == player for i in range(4)):
-                    return True
-
-        # Check secondary diagonals
-        for row in range(3, n_rows):
-            for col in range(n_cols - 3):
-                if all(self.board[row - i, col + i] == player for i in range(4)):
-                    return True
+        if n_rows >= 4 and n_cols >= 4:
+            # Check main diagonals
+            if np.logical_and.reduce(
+                [discs[i : n_rows - 3 + i, i : n_cols - 3 + i] for i in range(4)]
+            ).any():
+                return True
+            # Check secondary diagonals
+            if np.logical_and.reduce(
+                [discs[3 - i : n_rows - i, i : n_cols - 3 + i] for i in range(4)]
+            ).any():
+                return True
+
+        return False
+
+    def check_last_disc(self):
+        """
+        Check if the last disc added completes an alignment of 4 discs.
+        This is enough after each move, as any previous alignment would have ended the game.
+
+        :return: True if the player of the last disc has won, False otherwise
+        """
+
+        if self.last is None:
+            return False
+
+        row, col = self.last
+        player = self.board[row, col]
+
+        # Count the discs of the player in both directions from the last one
+        for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            count = 1
+            for sign in (1, -1):
+                r, c = row + sign * d_row, col + sign * d_col
+                while (
+                    0 <= r < self.n_rows
+                    and 0 <= c < self.n_cols
+                    and self.board[r, c] == player
+                ):
+                    count += 1
+                    r, c = r + sign * d_row, c + sign * d_col
+            if count >= 4:
+                return True
 
         return False
 
@@ -96,3 +141,142 @@ class Connect4State:
     def is_root(self):
         """Check if the board is empty."""
         return np.all(self.board == 0)
+
+
+@lru_cache(maxsize=None)
+def bottom_mask(n_rows, n_cols):
+    """Get the bitmask of the bottom row of the board."""
+    return sum(1 << (col * (n_rows + 1)) for col in range(n_cols))
+
+
+class Connect4Bitboard:
+
+    def __init__(self, n_rows, n_cols, position=0, mask=0, n_moves=0, last=0):
+
+        # Store board variables
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        # Use the same layout as the C solver, i.e. one bit per cell column by column, with a spare bit on top of each column
+        # The position holds the discs of the player to move, and the mask the discs of both players
+        self.height = n_rows + 1
+        self.position = position
+        self.mask = mask
+        self.n_moves = n_moves
+        # Keep the bit of the last disc added, as only lines through it can be new
+        self.last = last
+
+    def __str__(self):
+
+        # Print board rows in reverse order, as in Connect4State
+        return "-".join("".join(str(cell) for cell in row) for row in self.board[::-1])
+
+    @property
+    def player(self):
+        """Get the player to move, where player 1 always moves first."""
+        return 1 + self.n_moves % 2
+
+    @property
+    def key(self):
+        """
+        Get a unique key for the position, the same as the C solver.
+        Adding the bottom row to the mask sets a bit right above each column, so that the sum is unique.
+        """
+        return self.position + self.mask + bottom_mask(self.n_rows, self.n_cols)
+
+    @property
+    def board(self):
+        """Get the board as a NumPy array with the player numbers, where the first row is the bottom one."""
+
+        board = np.zeros((self.n_rows, self.n_cols), dtype=int)
+        discs = self.discs(self.player)
+        for col in range(self.n_cols):
+            for row in range(self.n_rows):
+                bit = 1 << (col * self.height + row)
+                if self.mask & bit:
+                    board[row, col] = self.player if discs & bit else 3 - self.player
+
+        return board
+
+    def discs(self, player):
+        """Get the discs of the player as a bitmask."""
+        return self.position if player == self.player else self.position ^ self.mask
+
+    def add_disc(self, idx_c, player):
+        """
+        Add a disc to the board in the specified column for the given player.
+
+        :param idx_c: Index of the column
+        :param player: Player number (1 or 2), which must be the player to move
+
+        :return: New Connect4Bitboard
+        """
+
+        if player != self.player:
+            raise ValueError("Player {} is not to move.".format(player))
+
+        # Switch the player, then adding the bottom cell of the column sets the lowest empty cell
+        bottom = 1 << (idx_c * self.height)
+        mask = self.mask | (self.mask + bottom)
+        return Connect4Bitboard(
+            n_rows=self.n_rows,
+            n_cols=self.n_cols,
+            position=self.position ^ self.mask,
+            mask=mask,
+            n_moves=self.n_moves + 1,
+            last=mask ^ self.mask,
+        )
+
+    def check_win(self, player):
+        """
+        Check if the specified player has a winning alignment of 4 discs.
+        For each direction, pairs of aligned discs are found with a shift, then pairs of pairs with a double shift.
+
+        :param player: Player number (1 or 2)
+        :return: True if the player has won, False otherwise
+        """
+
+        discs = self.discs(player)
+        # Vertical, 1st diagonal, horizontal and 2nd diagonal
+        for shift in (1, self.height - 1, self.height, self.height + 1):
+            pairs = discs & (discs >> shift)
+            if pairs & (pairs >> (2 * shift)):
+                return True
+
+        return False
+
+    def check_last_disc(self):
+        """
+        Check if the last disc added completes an alignment of 4 discs.
+        This is enough after each move, as any previous alignment would have ended the game.
+        Walking off the board always reaches a spare bit or leaves the bitboard, which hold no disc.
+
+        :return: True if the player of the last disc has won, False otherwise
+        """
+
+        if not self.last:
+            return False
+
+        # The last disc belongs to the player who just moved
+        discs = self.position ^ self.mask
+        for shift in (1, self.height - 1, self.height, self.height + 1):
+            count = 1
+            bit = self.last << shift
+            while bit & discs:
+                count += 1
+                bit <<= shift
+            bit = self.last >> shift
+            while bit & discs:
+                count += 1
+                bit >>= shift
+            if count >= 4:
+                return True
+
+        return False
+
+    def is_full(self):
+        """Check if the board is full (no empty cells)."""
+        return self.n_moves == self.n_rows * self.n_cols
+
+    def is_root(self):
+        """Check if the board is empty."""
+        return self.n_moves == 0
@@ -1,30 +1,91 @@
 #include <limits.h>
+#include <pthread.h>
+#include <stdatomic.h>
 #include <stdbool.h>
 #include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <time.h>
 
 
 // -------------------------------------------------- //
 // --- CONSTANTS AND TYPES -------------------------- //
 
 
+// The board size can be set at compile time, e.g. with -DROWS=7 -DCOLS=7
+#ifndef ROWS
 #define ROWS 6
-#define HEIGHT (ROWS+1)
+#endif
+#ifndef COLS
 #define COLS 7
+#endif
+#define HEIGHT (ROWS+1)
+
+// Moves are read as single digits
+#if COLS > 9
+#error "At most 9 columns are supported"
+#endif
+
+// Each column takes HEIGHT bits, so small boards fit a 64-bit integer and the others a 128-bit one
+#if HEIGHT*COLS <= 64
+typedef uint64_t bitboard_t;
+#elif HEIGHT*COLS <= 128
+typedef unsigned __int128 bitboard_t;
+#else
+#error "The board does not fit in 128 bits"
+#endif
+
+#define BIT(i) ((bitboard_t)1 << (i))
+
+// Proven results are offset by WIN_BASE, so that heuristic evaluations always stay below them
+#define WIN_BASE 1000
+// Bounds of the evaluation, safe to negate unlike INT_MIN
+#define MAX_SCORE (WIN_BASE + (ROWS*COLS+1)/2)
+#define INF (MAX_SCORE+1)
+
+
+// Number of entries of the transposition table, a prime to spread the keys
+#define TT_SIZE 1048573
+
+// Maximum number of threads searching a position
+#define MAX_THREADS 64
 
 
 typedef struct {
-    uint64_t position;  // Current player chips
-    uint64_t mask;      // All chips
+    bitboard_t position;  // Current player chips
+    bitboard_t mask;      // All chips
     int n_moves;
 } Board;
 
+typedef enum {EXACT, LOWER, UPPER} Bound;
+
+typedef struct {
+    int16_t value;      // Evaluation, or bound on it
+    uint8_t bound;      // Kind of bound stored
+    uint8_t depth;      // Depth searched below the position
+    uint8_t move;       // Best move found
+    uint8_t age;        // Search that stored the entry
+} Entry;
+
+typedef struct {
+    bitboard_t check;   // Position key xor data, 0 for empty slots
+    uint64_t data;      // Entry packed in 64 bits
+} Slot;
+
 
 // -------------------------------------------------- //
 // --- BITBOARD ------------------------------------- //
 
 
+static inline int popcount(bitboard_t bits) {
+#if HEIGHT*COLS <= 64
+    return __builtin_popcountll(bits);
+#else
+    return __builtin_popcountll((uint64_t)bits) + __builtin_popcountll((uint64_t)(bits >> 64));
+#endif
+}
+
 /**
  * Generate a bitmask representing the bottom row of the board.
  * It looks like 00...0100000010...1...
@@ -34,19 +95,19 @@ typedef struct {
  *                 15         49
  * Where the only 1s are evenly spaced every 7 bits.
  */
-static inline uint64_t bottom_mask() {
-    uint64_t mask = 0;
+static inline bitboard_t bottom_mask() {
+    bitboard_t mask = 0;
     for (int col = 0; col < COLS; col ++) {
-        // (1ULL << (col*HEIGHT)) shifts 1 by col*HEIGHT positions to get the 1st row of each column
+        // BIT(col*HEIGHT) shifts 1 by col*HEIGHT positions to get the 1st row of each column
         // Then just take the or to set the bit
-        mask |= (1ULL << (col*HEIGHT));
+        mask |= BIT(col*HEIGHT);
     }
     return mask;
 }
 
-static inline uint64_t bottom_mask_col(int col) {
+static inline bitboard_t bottom_mask_col(int col) {
     // Just take the first row of the column
-    return 1ULL << (col*HEIGHT);
+    return BIT(col*HEIGHT);
 }
 
 /**
@@ -58,20 +119,30 @@ static inline uint64_t bottom_mask_col(int col) {
  *                 15         49
  * Where the 1s are the first 6 rows for each column.
  */
-static inline uint64_t board_mask() {
-    // The binary multiplication by 0b(1ULL << HEIGHT)-1 = 63d turns any 1 into 111111
-    return bottom_mask() * ((1ULL << HEIGHT)-1);
+static inline bitboard_t board_mask() {
+    // The binary multiplication by BIT(ROWS)-1 = 0b111111 turns any 1 into ROWS 1s
+    return bottom_mask() * (BIT(ROWS)-1);
 }
 
-static inline uint64_t top_mask_col(int col) {
+static inline bitboard_t top_mask_col(int col) {
     // Just take the sixth row of the column
-    return 1ULL << (col*HEIGHT + ROWS-1);
+    return BIT(col*HEIGHT + ROWS-1);
 
 }
  
-static inline uint64_t col_mask(int col) {
+static inline bitboard_t col_mask(int col) {
     // Just take the column bits
-    return ((1ULL << ROWS)-1) << (col*HEIGHT);
+    return (BIT(ROWS)-1) << (col*HEIGHT);
+}
+
+/**
+ * Generate a bitmask representing every other row of the board, starting from the given one.
+ * Row 0 gives the odd rows counting from 1 at the bottom, row 1 the even ones.
+ */
+static inline bitboard_t alternate_rows_mask(int row) {
+    bitboard_t rows = 0;
+    for (; row < ROWS; row += 2) rows |= BIT(row);
+    return bottom_mask() * rows;
 }
 
 
@@ -95,10 +166,10 @@ void init_board(Board *board) {
  * 
  * The process is repeated for each direction.
  */
-bool check_win(uint64_t pos) {
+bool check_win(bitboard_t pos) {
     
     // Horizontal
-    uint64_t pos_shift = pos & (pos >> HEIGHT);
+    bitboard_t pos_shift = pos & (pos >> HEIGHT);
     if(pos_shift & (pos_shift >> (2*HEIGHT))) return true;
     
     // 1st and 2nd diagonal
@@ -136,22 +207,152 @@ bool is_full(Board *board) {
 // --- POSITION EVALUATION -------------------------- //
 
 
+/**
+ * Score of a win for the player to move, when n_moves moves have been played before the winning one.
+ * Earlier wins score higher, and all of them score above WIN_BASE.
+ */
+static inline int win_score(int n_moves) {
+    return WIN_BASE + (ROWS*COLS+1-n_moves) / 2;
+}
+
+static inline bool is_proven(int eval) {
+    return eval >= WIN_BASE || eval <= -WIN_BASE;
+}
+
+/**
+ * Get the empty cells that would complete 4 in a row for the owner of pos.
+ * For each direction, the cell is matched against 3 aligned chips:
+ *      - all on one side of it
+ *      - 2 on one side and 1 on the other, for horizontal and diagonal lines
+ * Shifts by HEIGHT move along a row, by HEIGHT-1 and HEIGHT+1 along the diagonals.
+ */
+bitboard_t winning_spots(bitboard_t pos, bitboard_t mask) {
+
+    // Vertical, only possible on top of the chips
+    bitboard_t spots = (pos << 1) & (pos << 2) & (pos << 3);
+
+    // Horizontal and diagonals
+    const int shifts[3] = {HEIGHT, HEIGHT-1, HEIGHT+1};
+    for (int i = 0; i < 3; i++) {
+        int s = shifts[i];
+        bitboard_t pair = (pos << s) & (pos << 2*s);
+        spots |= pair & (pos << 3*s);
+        spots |= pair & (pos >> s);
+        pair = (pos >> s) & (pos >> 2*s);
+        spots |= pair & (pos << s);
+        spots |= pair & (pos >> 3*s);
+    }
+
+    // Keep the empty cells only, as shifts may also land on chips or outside the board
+    return spots & (board_mask() ^ mask);
+}
+
+static inline bitboard_t playable_cells(Board *board) {
+    // The lowest empty cell of each column, the sum overflowing into the sentinel row of full columns
+    return (board->mask + bottom_mask()) & board_mask();
+}
+
+/**
+ * Evaluate a position from the point of view of the player to move, at the end of the search depth.
+ * A playable winning spot decides the game, and so do two playable winning spots of the opponent.
+ * Otherwise, the evaluation is the balance of winning spots, i.e. open threes.
+ * Spots weigh more on the rows that favour their owner: as the board fills up, the first player
+ * gets the odd rows counting from 1 at the bottom, and the second player the even ones.
+ */
 int evaluate_position(Board *board) {
-    return 0;
+
+    bitboard_t playable = playable_cells(board);
+    bitboard_t own = winning_spots(board->position, board->mask);
+    bitboard_t opp = winning_spots(board->position ^ board->mask, board->mask);
+
+    // Proven results
+    if (own & playable) return win_score(board->n_moves);
+    if (popcount(opp & playable) > 1) return -win_score(board->n_moves+1);
+
+    // The player to move is the first player if an even number of moves was played
+    bitboard_t own_rows = alternate_rows_mask(board->n_moves % 2);
+    bitboard_t opp_rows = board_mask() ^ own_rows;
+
+    int eval = 0;
+    eval += 3*popcount(own & own_rows) + popcount(own & opp_rows);
+    eval -= 3*popcount(opp & opp_rows) + popcount(opp & own_rows);
+    // A playable spot of the opponent forces the next move
+    eval -= 2*popcount(opp & playable);
+    return eval;
 }
 
 bool is_winning_move(Board *board, int col) {
     // Check if the move yields an immediate win for the current player
-    uint64_t pos = board->position;
+    bitboard_t pos = board->position;
     pos |= (board->mask + bottom_mask_col(col)) & col_mask(col);
     return check_win(pos);
 }
 
 bool is_losing_move(Board *board, int col) {
-    // Check if the move yields an immediate loss
-    uint64_t pos = board->position ^ board->mask;
-    pos |= (board->mask + bottom_mask_col(col)) & col_mask(col);
-    return check_win(pos);
+    // Check if the move yields an immediate loss, i.e. the opponent wins by playing right above it
+    bitboard_t above = ((board->mask + bottom_mask_col(col)) & col_mask(col)) << 1;
+    if (!(above & col_mask(col))) return false;
+    bitboard_t pos = board->position ^ board->mask;
+    return check_win(pos | above);
+}
+
+
+// -------------------------------------------------- //
+// --- TRANSPOSITION TABLE -------------------------- //
+
+
+/**
+ * The table is shared by all the search threads without locks.
+ * Each slot stores its entry packed in one word, and the key xored with it in the other.
+ * If two threads write the same slot at once, a reader may see the words of different writes,
+ * but then the xor does not give back the key and the slot is just treated as a miss.
+ */
+static Slot table[TT_SIZE];
+// Entries from previous searches can always be replaced
+static uint8_t table_age = 0;
+
+/**
+ * Get a unique key for the position.
+ * Adding the bottom row to the mask sets a bit right above each column, so that the sum is unique.
+ */
+static inline bitboard_t position_key(Board *board) {
+    return board->position + board->mask + bottom_mask();
+}
+
+static inline uint64_t pack_entry(Entry entry) {
+    return (uint64_t)(uint16_t)entry.value | (uint64_t)entry.bound << 16 | (uint64_t)entry.depth << 24
+        | (uint64_t)entry.move << 32 | (uint64_t)entry.age << 40;
+}
+
+static inline Entry unpack_entry(uint64_t data) {
+    Entry entry = {(int16_t)(data & 0xFFFF), (data >> 16) & 0xFF, (data >> 24) & 0xFF, (data >> 32) & 0xFF, (data >> 40) & 0xFF};
+    return entry;
+}
+
+/**
+ * Look up a position, copying its entry if found.
+ * Return whether the position was found.
+ */
+bool table_get(bitboard_t key, Entry *entry) {
+    Slot *slot = &table[key % TT_SIZE];
+    uint64_t data = slot->data;
+    if ((slot->check ^ data) != key) return false;
+    *entry = unpack_entry(data);
+    return true;
+}
+
+/**
+ * Store a search result.
+ * The slot is kept if it holds a deeper search of the current search, and overwritten otherwise.
+ */
+void table_put(bitboard_t key, int value, Bound bound, int depth, int move) {
+    Slot *slot = &table[key % TT_SIZE];
+    Entry old = unpack_entry(slot->data);
+    if (slot->check != 0 && old.age == table_age && old.depth > depth) return;
+    Entry entry = {value, bound, depth, move, table_age};
+    uint64_t data = pack_entry(entry);
+    slot->data = data;
+    slot->check = key ^ data;
 }
 
 
@@ -159,8 +360,90 @@ bool is_losing_move(Board *board, int col) {
 // --- MOVE ORDERING -------------------------------- //
 
 
-// First explore moves in the center
-static const int static_ordering[COLS] = {3, 2, 4, 1, 5, 0, 6};
+/**
+ * Get the columns from the center outwards, e.g. 3, 2, 4, 1, 5, 0, 6 for 7 columns.
+ * Moves in the center are explored first.
+ */
+static inline int center_col(int idx) {
+    return COLS/2 + (1 - 2*(idx%2)) * (idx+1)/2;
+}
+
+/**
+ * Score a move by the number of winning spots it leaves to the current player.
+ * Full columns score below any valid move.
+ */
+static inline int move_score(Board *board, int col) {
+    if (!is_valid_move(board, col)) return -1;
+    bitboard_t move = (board->mask + bottom_mask_col(col)) & col_mask(col);
+    return popcount(winning_spots(board->position | move, board->mask | move));
+}
+
+/**
+ * Get the order in which to explore the columns.
+ * The best move of a previous search is explored first, then the moves creating more threats.
+ * Ties are explored from the center, since the sort is stable.
+ */
+void order_moves(Board *board, int first, int *order) {
+    int n = 0;
+    if (first >= 0 && first < COLS) order[n++] = first;
+
+    // Insertion sort by decreasing score
+    int scores[COLS];
+    int start = n;
+    for (int idx = 0; idx < COLS; idx++) {
+        int col = center_col(idx);
+        if (col == first) continue;
+        int score = move_score(board, col);
+        int i = n++;
+        for (; i > start && scores[i-1] < score; i--) {
+            order[i] = order[i-1];
+            scores[i] = scores[i-1];
+        }
+        order[i] = col;
+        scores[i] = score;
+    }
+}
+
+
+// -------------------------------------------------- //
+// --- SEARCH LIMITS -------------------------------- //
+
+
+typedef struct {
+    uint64_t nodes;     // Nodes visited
+    uint64_t tt_hits;   // Positions found in the table
+    uint64_t cutoffs;   // Beta cutoffs
+} Counters;
+
+typedef struct {
+    int score;              // Evaluation of the best move
+    int depth;              // Depth of the last complete iteration
+    uint64_t nodes;         // Counters summed over all the threads
+    uint64_t tt_hits;
+    uint64_t cutoffs;
+    uint64_t elapsed_us;    // Wall time of the search
+} SearchStats;
+
+// Counters of each thread
+static _Thread_local Counters counters;
+// Statistics of the last search
+static SearchStats last_stats;
+// Time at which the search must stop, 0 for no limit
+static uint64_t deadline = 0;
+// Stop flag shared by all the threads
+static atomic_bool aborted = false;
+
+uint64_t now_us() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec*1000000 + ts.tv_nsec/1000;
+}
+
+static inline bool out_of_time() {
+    // Read the clock only every 1024 nodes
+    if (!aborted && deadline && (counters.nodes & 1023) == 0 && now_us() >= deadline) aborted = true;
+    return aborted;
+}
 
 
 // -------------------------------------------------- //
@@ -168,6 +451,10 @@ static const int static_ordering[COLS] = {3, 2, 4, 1, 5, 0, 6};
 
 
 int negamax(Board *board, int depth, int alpha, int beta) {
+
+    // Give up if the time is over, the result is then discarded
+    counters.nodes++;
+    if (out_of_time()) return 0;
     
     // Return the evaluation at terminal state
     if (depth == 0) return evaluate_position(board);
@@ -176,64 +463,251 @@ int negamax(Board *board, int depth, int alpha, int beta) {
     // Check if there is an immediate win
     for (int col = 0; col < COLS; col++) {
         if (is_valid_move(board, col) && is_winning_move(board, col)) {
-            return (ROWS*COLS+1-board->n_moves) / 2;
+            return win_score(board->n_moves);
+        }
+    }
+
+    // A playable winning spot of the opponent must be blocked, and two of them cannot be
+    bitboard_t forced = winning_spots(board->position ^ board->mask, board->mask) & playable_cells(board);
+    if (popcount(forced) > 1) return -win_score(board->n_moves+1);
+
+    // Look up the position, reached before through another sequence of moves or at a shallower depth
+    bitboard_t key = position_key(board);
+    Entry entry;
+    int first = -1;
+    if (table_get(key, &entry)) {
+        counters.tt_hits++;
+        first = entry.move;
+        if (entry.depth >= depth) {
+            if (entry.bound == EXACT) return entry.value;
+            if (entry.bound == LOWER && entry.value > alpha) alpha = entry.value;
+            if (entry.bound == UPPER && entry.value < beta) beta = entry.value;
+            if (alpha >= beta) return entry.value;
         }
     }
 
     // Initialize
-    int best_eval = INT_MIN;
-    
+    // If all moves are losing, the opponent wins at the next move
+    int alpha_orig = alpha;
+    int best_eval = -win_score(board->n_moves+1);
+    int best_move = COLS;
+    int order[COLS];
+    order_moves(board, first, order);
+
     // Loop over the columns
     for (int idx = 0; idx < COLS; idx++) {
-        int col = static_ordering[idx];
+        int col = order[idx];
+        if (forced && !(forced & col_mask(col))) continue;
         if (is_valid_move(board, col) && !is_losing_move(board, col)) {
             Board child = *board;
             make_move(&child, col);
             int eval = -negamax(&child, depth-1, -beta, -alpha);
+            if (aborted) return 0;
             // Update the best evaluation
-            best_eval = (eval > best_eval) ? eval : best_eval;
+            if (eval > best_eval) {
+                best_eval = eval;
+                best_move = col;
+            }
             alpha = (eval > alpha) ? eval : alpha;
-            if (alpha >= beta) break;
+            if (alpha >= beta) {
+                counters.cutoffs++;
+                break;
+            }
         }
     }
+
+    // Store the evaluation, which is only a bound if it fell outside the window
+    Bound bound = (best_eval <= alpha_orig) ? UPPER : (best_eval >= beta) ? LOWER : EXACT;
+    table_put(key, best_eval, bound, depth, best_move);
     return best_eval;
 }
 
-int find_best_move(Board *board, int depth) {
+int find_best_move(Board *board, int depth, int *best_eval_out) {
 
     // Check if there is an immediate win
     for (int col = 0; col < COLS; col++) {
         if (is_valid_move(board, col) && is_winning_move(board, col)) {
+            *best_eval_out = win_score(board->n_moves);
             return col;
         }
     }
 
     // Initialize
     int best_move = -1;
-    int best_eval = INT_MIN;
-    int alpha = INT_MIN;
-    int beta = INT_MAX;
+    int best_eval = -INF;
+    int alpha = -INF;
+    int beta = INF;
+
+    // Explore the best move of a previous search first
+    Entry entry;
+    int order[COLS];
+    order_moves(board, table_get(position_key(board), &entry) ? entry.move : -1, order);
 
     // Loop over the columns
     for (int idx = 0; idx < COLS; idx++) {
-        int col = static_ordering[idx];
+        int col = order[idx];
         if (is_valid_move(board, col)) {
             Board child = *board;
             make_move(&child, col);
             int eval = -negamax(&child, depth-1, -beta, -alpha);
+            if (aborted) return -1;
             // Update the best move and evaluation
             if (eval > best_eval) {
                 best_eval = eval;
                 best_move = col;
             }
             alpha = (eval > alpha) ? eval : alpha;
-            if (alpha >= beta) break;
+            if (alpha >= beta) {
+                counters.cutoffs++;
+                break;
+            }
         }
     }
+    table_put(position_key(board), best_eval, EXACT, depth, best_move);
+    *best_eval_out = best_eval;
+    return best_move;
+}
+
+// -------------------------------------------------- //
+// --- PARALLEL SEARCH ------------------------------ //
+
+
+// Number of threads searching each position, the main one included
+static int n_threads = 1;
+
+void set_threads(int threads) {
+    n_threads = (threads < 1) ? 1 : (threads > MAX_THREADS) ? MAX_THREADS : threads;
+}
+
+typedef struct {
+    Board board;
+    int max_depth;
+    int id;
+    Counters counters;  // Set when the helper ends
+} Helper;
+
+/**
+ * Search the position alongside the main thread, as in Lazy SMP.
+ * Helpers share nothing but the table, where their results speed up the main search.
+ * Helpers with an odd id start one ply deeper, so that threads spread over the depths.
+ */
+void *helper_search(void *arg) {
+    Helper *helper = arg;
+    counters = (Counters){0, 0, 0};
+    for (int depth = 1 + helper->id%2; depth <= helper->max_depth && !aborted; depth++) {
+        int eval = 0;
+        find_best_move(&helper->board, depth, &eval);
+        // An aborted search leaves the evaluation unset
+        if (aborted || is_proven(eval)) break;
+    }
+    helper->counters = counters;
+    return NULL;
+}
+
+/**
+ * Search deeper and deeper until the time budget or the maximum depth is reached.
+ * Each iteration explores first the best moves of the previous one, which are kept in the table.
+ * Helper threads search the same position meanwhile, and are stopped when the main search ends.
+ * Return the best move of the last complete iteration, and store its evaluation in eval_out.
+ * The statistics of the search are kept in last_stats.
+ */
+int iterative_deepening(Board *board, int max_depth, int budget_ms, int *eval_out) {
+
+    uint64_t start = now_us();
+    counters = (Counters){0, 0, 0};
+    aborted = false;
+    deadline = (budget_ms > 0) ? start + (uint64_t)budget_ms*1000 : 0;
+
+    // There is no point in searching beyond the end of the game
+    int remaining = ROWS*COLS - board->n_moves;
+    if (max_depth > remaining) max_depth = remaining;
+
+    // Start the helpers, going on with fewer of them if a thread cannot be created
+    pthread_t threads[MAX_THREADS];
+    Helper helpers[MAX_THREADS];
+    int n_helpers = 0;
+    for (int id = 1; id < n_threads; id++) {
+        helpers[n_helpers] = (Helper){*board, max_depth, id, {0, 0, 0}};
+        if (pthread_create(&threads[n_helpers], NULL, helper_search, &helpers[n_helpers]) != 0) break;
+        n_helpers++;
+    }
+
+    // The first iteration visits a handful of nodes, so it is never aborted
+    int best_move = -1;
+    int best_depth = 0;
+    *eval_out = 0;
+    for (int depth = 1; depth <= max_depth; depth++) {
+        int eval;
+        int move = find_best_move(board, depth, &eval);
+        if (aborted) break;
+        best_move = move;
+        best_depth = depth;
+        *eval_out = eval;
+        // A forced win or loss was found, so deeper searches would not change the evaluation
+        if (is_proven(eval)) break;
+    }
+
+    // Stop the helpers, whose work only matters during the main search
+    aborted = true;
+    Counters total = counters;
+    for (int i = 0; i < n_helpers; i++) {
+        pthread_join(threads[i], NULL);
+        total.nodes += helpers[i].counters.nodes;
+        total.tt_hits += helpers[i].counters.tt_hits;
+        total.cutoffs += helpers[i].counters.cutoffs;
+    }
+    last_stats = (SearchStats){*eval_out, best_depth, total.nodes, total.tt_hits, total.cutoffs, now_us() - start};
+
+    deadline = 0;
     return best_move;
 }
 
 
+/**
+ * Play a sequence of moves, given as a string of 1-based columns.
+ * Return the index of the first invalid move, or -1 if all moves are valid.
+ */
+int play_sequence(Board *board, const char *pos_str) {
+    for (int i = 0; pos_str[i] != '\0'; ++i) {
+        int col = (pos_str[i]-'0') - 1;
+        if (col < 0 || col >= COLS || !is_valid_move(board, col)) return i;
+        make_move(board, col);
+    }
+    return -1;
+}
+
+/**
+ * Search a position given as a string, up to max_depth and stopping after budget_ms milliseconds if positive.
+ * Return the best 1-based column, or 0 if the position is invalid, and store the evaluation in eval_out.
+ */
+int search_position(const char *pos_str, int max_depth, int budget_ms, int *eval_out) {
+    Board board;
+    init_board(&board);
+    *eval_out = 0;
+    last_stats = (SearchStats){0, 0, 0, 0, 0, 0};
+    if (play_sequence(&board, pos_str) >= 0) return 0;
+    // Start a new search, keeping the table warm from the previous ones
+    table_age++;
+    return iterative_deepening(&board, max_depth, budget_ms, eval_out) + 1;
+}
+
+/**
+ * Entry point of the shared library.
+ * Return the best 1-based column for the given position, or 0 if the position is invalid.
+ */
+int solve(const char *pos_str, int max_depth, int budget_ms) {
+    int eval;
+    return search_position(pos_str, max_depth, budget_ms, &eval);
+}
+
+/**
+ * Copy the statistics of the last search, for the callers of the shared library.
+ */
+void get_stats(SearchStats *stats) {
+    *stats = last_stats;
+}
+
+
 // -------------------------------------------------- //
 // --- PRINT ---------------------------------------- //
 
@@ -241,7 +715,7 @@ int find_best_move(Board *board, int depth) {
 void print_board(Board *board) {
     for (int row = ROWS-1; row >= 0; row--) {
         for (int col = 0; col < COLS; col++) {
-            uint64_t idx = 1ULL << (col*HEIGHT + row);
+            bitboard_t idx = BIT(col*HEIGHT + row);
             if (board->mask & idx) {
                 printf("%c ", (board->position & idx) ? 'x' : 'o');
             } else {
@@ -258,14 +732,121 @@ void print_board(Board *board) {
 // --- MAIN FUNCTION -------------------------------- //
 
 
+// The library is built with -DC4_LIBRARY and only exposes solve, get_stats and set_threads
+#ifndef C4_LIBRARY
+
+// Print the result of each search with its statistics, given the --stats flag
+static bool print_stats = false;
+
+/**
+ * Print the result of the last search as a JSON object on one line.
+ */
+void print_stats_json(int move) {
+    printf(
+        "{\"move\": %d, \"score\": %d, \"depth\": %d, \"nodes\": %llu, \"tt_hits\": %llu, \"cutoffs\": %llu, \"elapsed_us\": %llu}\n",
+        move, last_stats.score, last_stats.depth, (unsigned long long)last_stats.nodes,
+        (unsigned long long)last_stats.tt_hits, (unsigned long long)last_stats.cutoffs,
+        (unsigned long long)last_stats.elapsed_us
+    );
+}
+
+/**
+ * Serve requests from stdin until it is closed, so that a single process answers many positions.
+ * Each request is a line "<depth> <budget_ms> [position_string]".
+ * Each response is a line with the best 1-based column, or 0 if the request is invalid.
+ * With --stats, the response is instead the JSON object of print_stats_json.
+ */
+int serve() {
+    char line[256];
+    while (fgets(line, sizeof(line), stdin)) {
+        int depth, budget_ms;
+        char pos_str[128] = "";
+        int move = 0;
+        // Invalid requests are not searched, so they report empty statistics
+        last_stats = (SearchStats){0, 0, 0, 0, 0, 0};
+        if (sscanf(line, "%d %d %127s", &depth, &budget_ms, pos_str) >= 2) {
+            move = solve(pos_str, depth, budget_ms);
+        }
+        // Flush at every response, since the client waits for it
+        if (print_stats) print_stats_json(move);
+        else printf("%d\n", move);
+        fflush(stdout);
+    }
+    return 0;
+}
+
+/**
+ * Analyse the positions of a file, one position string per line, until it ends.
+ * Each result is a line "<move> <score> <nodes>", where move is the best 1-based column, or 0 if the
+ * position is invalid or the line blank, and score the evaluation for the player to move.
+ * Scores of at least WIN_BASE in absolute value are proven, e.g. WIN_BASE+k wins with k chips left.
+ * With --stats, each result is instead the JSON object of print_stats_json.
+ * The table is kept across positions, so that positions of the same game share their work.
+ */
+int batch(FILE *in, int depth, int budget_ms) {
+    char line[256];
+    while (fgets(line, sizeof(line), in)) {
+        char pos_str[128] = "";
+        int eval = 0;
+        int move = 0;
+        // Blank lines are answered as invalid, rather than searching the empty board
+        if (sscanf(line, "%127s", pos_str) == 1) {
+            move = search_position(pos_str, depth, budget_ms, &eval);
+        } else {
+            last_stats = (SearchStats){0, 0, 0, 0, 0, 0};
+        }
+        // Stream the results, as each position may take a while
+        if (print_stats) print_stats_json(move);
+        else printf("%d %d %llu\n", move, eval, (unsigned long long)last_stats.nodes);
+        fflush(stdout);
+    }
+    return 0;
+}
+
 int main(int argc, char *argv[]) {
+
+    // Take out the --stats flag, wherever it is
+    int n_args = 0;
+    for (int i = 0; i < argc; i++) {
+        if (strcmp(argv[i], "--stats") == 0) print_stats = true;
+        else argv[n_args++] = argv[i];
+    }
+    argc = n_args;
+
     if (argc < 2) {
-        printf("Usage: %s <depth> [position_string]\n", argv[0]);
+        printf("Usage: %s <depth> [position_string] [budget_ms] [threads] [--stats]\n", argv[0]);
+        printf("       %s --serve [threads] [--stats]\n", argv[0]);
+        printf("       %s --batch <depth> <budget_ms> [positions_file] [threads] [--stats]\n", argv[0]);
         return 1;
     }
+    if (strcmp(argv[1], "--serve") == 0) {
+        if (argc >= 3) set_threads(atoi(argv[2]));
+        return serve();
+    }
+    if (strcmp(argv[1], "--batch") == 0) {
+        if (argc < 4) {
+            printf("Usage: %s --batch <depth> <budget_ms> [positions_file] [threads]\n", argv[0]);
+            return 1;
+        }
+        // Read the positions from stdin if no file is given
+        FILE *in = stdin;
+        if (argc >= 5 && strcmp(argv[4], "-") != 0) {
+            in = fopen(argv[4], "r");
+            if (!in) {
+                printf("Cannot open %s\n", argv[4]);
+                return 1;
+            }
+        }
+        if (argc >= 6) set_threads(atoi(argv[5]));
+        int result = batch(in, atoi(argv[2]), atoi(argv[3]));
+        if (in != stdin) fclose(in);
+        return result;
+    }
     int depth = atoi(argv[1]);
     char *pos_str = NULL;
     if (argc >= 3) pos_str = argv[2];
+    int budget_ms = (argc >= 4) ? atoi(argv[3]) : 0;
+    if (argc >= 5) set_threads(atoi(argv[4]));
 
     // Initialize the board
     Board board;
@@ -273,17 +854,18 @@ int main(int argc, char *argv[]) {
 
     // Parse position string and play moves in order
     if (pos_str) {
-        for (int i = 0; pos_str[i] != '\0'; ++i) {
-            int col = (pos_str[i]-'0') - 1;
-            if (col < 0 || col >= COLS || !is_valid_move(&board, col)) {
-                printf("Invalid move detected at char %d ('%c')\n", i, pos_str[i]);
-                return 1;
-            }
-            make_move(&board, col);
+        int i = play_sequence(&board, pos_str);
+        if (i >= 0) {
+            printf("Invalid move detected at char %d ('%c')\n", i, pos_str[i]);
+            return 1;
         }
     }
 
-    int move = find_best_move(&board, depth);
-    printf("%d", move+1);
+    int eval;
+    int move = iterative_deepening(&board, depth, budget_ms, &eval);
+    if (print_stats) print_stats_json(move+1);
+    else printf("%d", move+1);
     return 0;
 }
+
+#endif
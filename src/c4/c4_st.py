@@ -1,8 +1,35 @@
-from src.c4.c4_game import Connect4State
+from src.c4.c4_book import get_book
+from src.c4.c4_engine import BACKEND, POOL_SIZE, get_backend
+from src.c4.c4_game import Connect4Bitboard
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import atexit
+import json
+import logging
 import os
 import platform
+import queue
 import streamlit as st
-import subprocess
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # File locks are only available on Unix
+    fcntl = None
+
+
+# Time given to the bot's search, in milliseconds
+BOT_BUDGET_MS = 500
+
+# Moves searched in positions missing from the opening book are saved to the openings, up to this number of moves
+OPENINGS_MAX_PLY = 8
+
+# Searches pondering for all sessions, one server being always left for the moves actually played
+# The in-process engine runs one search at a time, so it has none to spare
+PONDER_WORKERS = POOL_SIZE - 1 if BACKEND == "pool" else 0
+
+logger = logging.getLogger(__name__)
 
 
 ### -------------------------------------------------- ###
@@ -17,9 +44,11 @@ def init_connect4_state():
             "n_rows": 6,
             "n_cols": 7,
             "game_on": False,
-            "game_state": Connect4State(6, 7),
+            "game_state": Connect4Bitboard(6, 7),
             "game_descr": "",
             "user": 1,
+            "pondering": dict(),
+            "bot_metrics": [],
         }
 
 
@@ -42,24 +71,144 @@ def apply_move(col, new_state):
 ### --- OPENINGS ------------------------------------- ###
 
 
+class Openings:
+
+    def __init__(self, path):
+
+        # Keep the openings in memory, so that lookups never touch the disk
+        self.path = path
+        self.moves = self.read()
+        self.lock = threading.Lock()
+
+        # New openings are appended to the file by a background thread, so that the bot never waits for it
+        # The file is only appended to, so that concurrent writers cannot lose each other's lines
+        self.pending = queue.Queue()
+        threading.Thread(target=self.write_behind, daemon=True).start()
+        atexit.register(self.flush)
+
+    def read(self):
+        """Read the openings file into a dictionary, later lines overriding earlier ones."""
+
+        moves = dict()
+        with open(self.path, "r") as f:
+            lock_file(f, shared=True)
+            for line in f:
+                line = line.strip()
+                if line:
+                    position, move = line.split(":", 1)
+                    moves[position.strip()] = int(move.strip())
+
+        return moves
+
+    def get(self, position):
+        """Get the cached move at the position, or None if missing."""
+        return self.moves.get(position)
+
+    def add(self, position, move):
+        """Cache a move in memory and queue it to be saved."""
+
+        with self.lock:
+            if position in self.moves:
+                return
+            self.moves[position] = move
+        self.pending.put((position, move))
+
+    def write(self, entries):
+        """Append the entries to the file, holding an exclusive lock on it."""
+
+        if not entries:
+            return
+        with open(self.path, "a") as f:
+            lock_file(f, shared=False)
+            f.writelines(f"{position}:{move}\n" for position, move in entries)
+
+    def drain(self):
+        """Take all the pending entries."""
+
+        entries = []
+        while True:
+            try:
+                entries.append(self.pending.get_nowait())
+            except queue.Empty:
+                return entries
+
+    def write_behind(self):
+        while True:
+            # Wait for an entry, then write it together with all those queued meanwhile
+            entry = self.pending.get()
+            self.write([entry] + self.drain())
+
+    def flush(self):
+        """Save the pending entries, as the process exits."""
+        self.write(self.drain())
+
+
+def lock_file(f, shared):
+    """Lock an open file until it is closed, if file locks are available."""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+
+@st.cache_resource(show_spinner=False)
 def load_openings():
-    """Load openings from text file into a dictionary."""
-    openings = {}
-    openings_path = os.path.join(os.getcwd(), "src", "c4", "openings.txt")
-    with open(openings_path, "r") as f:
-        for line in f:
-            line = line.strip()
-            position, move = line.split(":", 1)
-            openings[position.strip()] = int(move.strip())
-    return openings
+    """Load the openings once per process, sharing them across sessions."""
+    return Openings(os.path.join(os.getcwd(), "src", "c4", "openings.txt"))
+
+
+### -------------------------------------------------- ###
+### --- PONDERING ------------------------------------ ###
+
 
+@st.cache_resource(show_spinner=False)
+def load_ponder_executor():
+    """Get the threads pondering for all sessions, fewer than the solver servers they wait on."""
+    return ThreadPoolExecutor(max_workers=PONDER_WORKERS)
 
-def save_openings(openings):
-    """Save openings dictionary to text file."""
-    openings_path = os.path.join(os.getcwd(), "src", "c4", "openings.txt")
-    with open(openings_path, "w") as f:
-        for position, move in sorted(openings.items()):
-            f.write(f"{position}:{move}\n")
+
+def ponder(position):
+    """
+    Start searching the bot's reply to each possible user's move, while the user thinks.
+    The searches of the previous move are cancelled if not started yet.
+    Replies found in the opening book or in the openings are instant, so they are not searched.
+    With a single solver server or the in-process engine, there is none to spare and the bot does not ponder.
+
+    :param position: The current game state as a string, with the user to move.
+    """
+
+    stop_pondering()
+    if PONDER_WORKERS < 1:
+        return
+
+    n_rows = st.session_state.connect4["n_rows"]
+    n_cols = st.session_state.connect4["n_cols"]
+    standard = (n_rows, n_cols) == (6, 7)
+
+    try:
+        pool = get_backend(n_rows, n_cols)
+    except Exception:
+        # The bot will report the error when asked for its move
+        return
+
+    # Start from the central columns, where the user is more likely to play
+    executor = load_ponder_executor()
+    center = (n_cols + 1) / 2
+    for col in sorted(range(1, n_cols + 1), key=lambda col: abs(col - center)):
+        reply = position + str(col)
+        if position.count(str(col)) >= n_rows:
+            continue
+        if standard and get_known_move(reply) is not None:
+            continue
+        st.session_state.connect4["pondering"][reply] = executor.submit(
+            pool.search, reply, BOT_BUDGET_MS
+        )
+
+
+def stop_pondering():
+    """Cancel the searches not started yet and forget all of them."""
+
+    for future in st.session_state.connect4["pondering"].values():
+        future.cancel()
+    st.session_state.connect4["pondering"] = dict()
 
 
 ### -------------------------------------------------- ###
@@ -80,6 +229,9 @@ def play():
         new_state = st.session_state.connect4["game_state"].add_disc(bot_move - 1, bot)
         apply_move(bot_move, new_state)
 
+    # Get ready for the user's move
+    ponder(st.session_state.connect4["game_descr"])
+
 
 def move(col):
     """
@@ -99,7 +251,7 @@ def move(col):
     apply_move(col + 1, new_state)
 
     # Check if user's move ends the game
-    if new_state.check_win(player):
+    if new_state.check_last_disc():
         terminate_game("user wins")
         return
     elif new_state.is_full():
@@ -115,61 +267,119 @@ def move(col):
     apply_move(bot_move, new_state)
 
     # Check if bot's move ends the game
-    if new_state.check_win(bot):
+    if new_state.check_last_disc():
         terminate_game("bot wins")
     elif new_state.is_full():
         terminate_game("draw")
+    else:
+        # Get ready for the user's next move
+        ponder(st.session_state.connect4["game_descr"])
 
 
 def get_bot_move(position):
     """
     Get the bot's move based on the current position.
-    To do so, call the C4 solver executable with the position string.
-    If the position is cached in the openings file, return it.
+    Early positions are answered by the precomputed opening book.
+    If the reply was pondered while the user was thinking, wait for that search.
+    Otherwise, send the position to the pool of C4 solver servers, which stay alive across moves.
+    If the servers cannot be started, call the C4 solver executable with the position string instead.
+    If the position is cached in the openings, return it.
+    The book, the openings and the executable only cover the standard 6x7 board.
 
     :param position: The current game state as a string.
 
     :return: The column where to drop the disc.
     """
 
+    n_rows = st.session_state.connect4["n_rows"]
+    n_cols = st.session_state.connect4["n_cols"]
+    standard = (n_rows, n_cols) == (6, 7)
+    start = perf_counter()
+
     # At the beginning, the best column is the central one
     if not position:
-        return 4
-
-    # Load current openings from file and check if we have a cached move
-    openings = load_openings()
-    if position in openings:
-        return openings[position]
-
-    exe_path = os.path.join(os.getcwd(), "src", "c4", "c4_solver")
-    command = [exe_path, position]
+        return n_cols // 2 + 1
+
+    if standard:
+        move_col = get_known_move(position)
+        if move_col is not None:
+            record_bot_move(position, "book", start)
+            return move_col
+
+    # Keep the search of the move played, and cancel the others to free the servers
+    # A search still queued behind other sessions is cancelled too, as searching now is faster
+    future = st.session_state.connect4["pondering"].pop(position, None)
+    # Cancelling only succeeds if the search has not started
+    if future is not None and future.cancel():
+        future = None
+    stop_pondering()
 
     try:
-        os.chmod(exe_path, 0o755)
-    except:
-        pass
-    try:
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        if result.returncode != 0:
+        if future is not None:
+            source = "ponder"
+            stats = future.result()
+        else:
+            source = "search"
+            stats = get_backend(n_rows, n_cols).search(position, BOT_BUDGET_MS)
+        move_col = stats["move"]
+        if move_col is None:
             st.error("Error while getting bot move. Please retry.")
             return None
-        move_col = int(result.stdout.strip())
-
-        # Save this move to the openings and update the file
-        if len(position) < 5:
-            openings[position] = move_col
-            save_openings(openings)
-
-        return move_col
     except Exception as e:
+        # The servers cannot be built or started, so report it rather than waiting on them
         st.error("Bot move failed: " + str(e))
         return None
 
+    # Save this move to the openings, the file being updated in the background
+    # A searched position is never in the book, so the openings extend it past its last ply
+    if standard and len(position) < OPENINGS_MAX_PLY:
+        load_openings().add(position, move_col)
+
+    record_bot_move(position, source, start, stats)
+    return move_col
+
+
+def record_bot_move(position, source, start, stats=None):
+    """
+    Store the metrics of a bot move in the session state and log them.
+
+    :param position: The game state as a string, before the bot move.
+    :param source: Where the move comes from, i.e. "book", "ponder" or "search".
+    :param start: The time at which the bot was asked to move, from perf_counter.
+    :param stats: The statistics of the search, if the move was searched.
+    """
+
+    metrics = {
+        "position": position,
+        "source": source,
+        "latency_us": int((perf_counter() - start) * 1e6),
+    }
+    if stats is not None:
+        metrics.update({key: val for key, val in stats.items() if key != "move"})
+
+    st.session_state.connect4["bot_metrics"].append(metrics)
+    logger.info("Bot move %s", json.dumps(metrics))
+
+
+def get_known_move(position):
+    """
+    Get the move of a position from the opening book or the openings, without searching.
+
+    :param position: The current game state as a string.
+
+    :return: The column where to drop the disc, or None if the position is not known.
+    """
+
+    # Check if the position is in the opening book
+    book = get_book()
+    if book is not None:
+        move_col = book.move(position)
+        if move_col is not None:
+            return move_col
+
+    # Check if the move was searched in an earlier game, past the book or when it was never built
+    return load_openings().get(position)
+
 
 def terminate_game(status):
     """Terminate the game and update the end status."""
@@ -179,12 +389,15 @@ def terminate_game(status):
     st.session_state.connect4["end_status"] = status
     st.session_state.connect4["game_on"] = False
 
+    # The searches of the replies are useless now, so free the servers for other sessions
+    stop_pondering()
+
 
 def reset():
     """Reset the game state and variables."""
 
     # Reset the board and instantiate a new root
-    st.session_state.connect4["game_state"] = Connect4State(
+    st.session_state.connect4["game_state"] = Connect4Bitboard(
         n_rows=st.session_state.connect4["n_rows"],
         n_cols=st.session_state.connect4["n_cols"],
     )
@@ -192,3 +405,5 @@ def reset():
     # Reset the game variables
     st.session_state.connect4["end_status"] = None
     st.session_state.connect4["game_descr"] = ""
+    st.session_state.connect4["bot_metrics"] = []
+    stop_pondering()
@@ -0,0 +1,78 @@
+from src.chomp.chomp_minimax import ChompState, negamax
+from time import perf_counter
+import argparse
+import json
+import platform
+import sys
+import tracemalloc
+
+
+### -------------------------------------------------- ###
+### --- BENCHMARK ------------------------------------ ###
+
+
+def bench_board(n_rows, n_cols, repeat=1):
+    """
+    Solve a board from the root and measure the work done by negamax.
+    The wall time is the best of the runs, while memory is traced in a separate run as tracing slows it down.
+
+    :param n_rows: The number of rows of the board.
+    :param n_cols: The number of columns of the board.
+    :param repeat: The number of timed runs.
+
+    :return: A dictionary with the results.
+    """
+
+    wall_time = float("inf")
+    for _ in range(repeat):
+        stats = dict()
+        start = perf_counter()
+        _, _, memo = negamax(ChompState(n_rows, n_cols), True, stats=stats)
+        wall_time = min(wall_time, perf_counter() - start)
+
+    tracemalloc.start()
+    negamax(ChompState(n_rows, n_cols), True)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "board": "{}x{}".format(n_rows, n_cols),
+        "wall_time": wall_time,
+        "nodes": stats["nodes"],
+        "memo_size": len(memo),
+        "memo_hits": stats["memo_hits"],
+        "memo_hit_rate": stats["memo_hits"] / stats["nodes"],
+        "peak_memory": peak_memory,
+    }
+
+
+def bench_all(max_rows, max_cols, repeat=1):
+    """Benchmark all boards from 2x2 up to the given size."""
+
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "boards": [
+            bench_board(n_rows, n_cols, repeat)
+            for n_rows in range(2, max_rows + 1)
+            for n_cols in range(2, max_cols + 1)
+        ],
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the Chomp solver.")
+    parser.add_argument("--max-rows", type=int, default=8)
+    parser.add_argument("--max-cols", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON file, stdout if not given")
+    args = parser.parse_args()
+
+    results = bench_all(args.max_rows, args.max_cols, args.repeat)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -1,25 +1,99 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+import threading
+
+
+### -------------------------------------------------- ###
+### --- BOARD MASKS ---------------------------------- ###
+
+
+@lru_cache(maxsize=None)
+def bite_masks(n_rows, n_cols):
+    """
+    Precompute the cells removed by each bite on a board of the given size.
+    Cells are stored as bits of an integer, where cell (i, j) is the bit i*n_cols + j.
+
+    :param n_rows: The number of rows of the board.
+    :param n_cols: The number of columns of the board.
+
+    :return: A tuple with one bitmask per cell, in row-major order.
+    """
+
+    masks = []
+    for i in range(n_rows):
+        for j in range(n_cols):
+            # Biting at (i, j) removes the whole bottom-right rectangle
+            row = ((1 << (n_cols - j)) - 1) << j
+            masks.append(sum(row << (r * n_cols) for r in range(i, n_rows)))
+
+    return tuple(masks)
+
+
+def transpose(cells, n):
+    """
+    Transpose the cells of a square board.
+
+    :param cells: The bitmask of the cells.
+    :param n: The size of the board.
+
+    :return: The bitmask of the transposed cells.
+    """
+
+    t = 0
+    for i in range(n):
+        for j in range(n):
+            if cells >> (i * n + j) & 1:
+                t |= 1 << (j * n + i)
+
+    return t
+
+
+### -------------------------------------------------- ###
+### --- GAME STATE ----------------------------------- ###
+
+
 class ChompState:
 
+    # States are created at every node of the search, so keep them as light as possible
+    __slots__ = (
+        "n_rows",
+        "n_cols",
+        "cells",
+        "t_cells",
+        "last_r",
+        "last_c",
+        "skipped_cells",
+    )
+
     def __init__(
         self,
         n_rows,
         n_cols,
+        cells=None,
+        t_cells=None,
         last_r=None,
         last_c=None,
-        parent_cells=None,
         skipped_cells=0,
     ):
 
         self.n_rows = n_rows
         self.n_cols = n_cols
+        # The remaining cells are stored as a bitmask, the full board being the root
+        self.cells = (1 << (n_rows * n_cols)) - 1 if cells is None else cells
+
+        # On square boards a state and its transpose are equivalent, so track the transposed cells too
+        if n_rows != n_cols:
+            self.t_cells = None
+        elif t_cells is None:
+            self.t_cells = transpose(self.cells, n_rows)
+        else:
+            self.t_cells = t_cells
+
         # The chomped cell corresponds to the bottom-right corner of the board
         self.last_r = last_r
         self.last_c = last_c
-
-        # Compute available bites for current state
-        # Parent bites are passed because just previously available bites are allowed here
-        self.moves = self.init_allowed_moves(parent_cells)
-        self.skipped_cells = skipped_cells + self.count_skipped_cells(parent_cells)
+        self.skipped_cells = skipped_cells
 
     def __str__(self):
 
@@ -33,58 +107,220 @@ class ChompState:
 
         return s
 
-    def init_allowed_moves(self, parent_cells):
+    @property
+    def key(self):
+        # The bitmask of the remaining cells is a unique identifier of the state
+        # On square boards the lowest of the two orientations identifies both the state and its transpose
+        if self.t_cells is not None and self.t_cells < self.cells:
+            return self.t_cells
+        return self.cells
 
-        if self.is_root():
-            # All cells are allowed at root state
-            l = [(i, j) for i in range(self.n_rows) for j in range(self.n_cols)]
-            # Always discard poison cell
-            l.pop(0)
-        else:
-            l = []
+    def orient(self, move):
+        """
+        Map a move between the state and the orientation identified by its key.
+        Transposing is an involution, so the same map works both ways.
+
+        :param move: The bite as a (row, col) tuple.
+
+        :return: The bite in the other orientation.
+        """
 
-            # Only previously available bites are allowed again
-            for i, j in parent_cells:
-                if i >= self.last_r and j >= self.last_c:
-                    pass
-                else:
-                    l.append((i, j))
-        return l
+        if self.t_cells is not None and self.t_cells < self.cells:
+            return move[1], move[0]
+        return move
 
-    def count_skipped_cells(self, parent_cells):
-        return 0 if self.is_root() else len(parent_cells) - len(self.moves) - 1
+    @property
+    def moves(self):
+
+        moves = []
+        # All remaining cells are allowed bites, but the poison cell is always discarded
+        # Bits are popped from the lowest one, so that moves are listed in row-major order
+        cells = self.cells & ~1
+        while cells:
+            low = cells & -cells
+            moves.append(divmod(low.bit_length() - 1, self.n_cols))
+            cells ^= low
+
+        return moves
 
     def bite(self, idx_r, idx_c):
 
         # Return a new state
         # Storing all children for all states would be too memory-intensive and with redundant information
         # This is not properly a tree, but it acts as such
+        masks = bite_masks(self.n_rows, self.n_cols)
+        eaten = self.cells & masks[idx_r * self.n_cols + idx_c]
+
+        # The transposed bite removes the transposed cells
+        t_cells = None
+        if self.t_cells is not None:
+            t_cells = self.t_cells & ~masks[idx_c * self.n_cols + idx_r]
+
         return ChompState(
             n_rows=self.n_rows,
             n_cols=self.n_cols,
+            cells=self.cells ^ eaten,
+            t_cells=t_cells,
             last_r=idx_r,
             last_c=idx_c,
-            parent_cells=self.moves,
-            skipped_cells=self.skipped_cells,
+            # All cells eaten except the bitten one are skipped
+            skipped_cells=self.skipped_cells + eaten.bit_count() - 1,
         )
 
     def is_root(self):
         return self.last_r is None and self.last_c is None
 
     def is_terminal(self):
-        return len(self.moves) == 0
+        # Only the poison cell is left
+        return self.cells == 1
+
+
+### -------------------------------------------------- ###
+### --- MEMO ----------------------------------------- ###
+
+
+class BoundedMemo(OrderedDict):
+
+    def __init__(self, max_size):
+
+        # Keep at most max_size states between searches, evicting the least recently used ones
+        # Evicting during a search would make it solve the evicted subtrees again and again
+        # So while searches run, the memo grows up to all the positions they visit, at most the whole board
+        super().__init__()
+        self.max_size = max_size
+        # The memo can be shared by searches running in different threads
+        self.lock = threading.Lock()
+        self.n_searches = 0
+
+    @contextmanager
+    def pinned(self):
+        """Keep all the states while a search runs, then trim the memo once no search is running."""
+
+        with self.lock:
+            self.n_searches += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.n_searches -= 1
+                if self.n_searches == 0:
+                    while len(self) > self.max_size:
+                        self.popitem(last=False)
+
+    def get(self, key, default=None):
+
+        with self.lock:
+            if key not in self:
+                return default
+
+            # Mark the state as recently used
+            self.move_to_end(key)
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+
+        with self.lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
 
 
 ### -------------------------------------------------- ###
 ### --- NEGAMAX ALGORITHM ---------------------------- ###
 
 
-def negamax(state, maximizer, memo=None):
+class SearchFrame:
+
+    # A frame of the explicit stack, replacing a recursive call of negamax
+    __slots__ = (
+        "state",
+        "maximizer",
+        "moves",
+        "idx",
+        "best_move",
+        "max_eval",
+        "n_skipped",
+    )
+
+    def __init__(self, state, maximizer):
+
+        self.state = state
+        self.maximizer = maximizer
+        self.moves = state.moves
+        # Index of the next move to explore
+        self.idx = 0
+
+        # Initialize best evaluation and move
+        self.best_move = None
+        self.max_eval = -float("inf")
+
+        # Initalize count of skipped moves
+        # This is done because if two moves have the same evaluation, another criterion is needed
+        # The maximizer aims to maximize it and the minimizer aims to minimize it
+        self.n_skipped = -float("inf") if maximizer else +float("inf")
+
+    def update(self, move, child, eval):
+        """
+        Update the best move and evaluation with an explored child.
+
+        :param move: The bite leading to the child.
+        :param child: The child state.
+        :param eval: The evaluation of the child for the current player.
+        """
+
+        # Update both best move and evaluation if current move is better
+        if eval > self.max_eval:
+            self.best_move = move
+            self.max_eval = eval
+
+        # Update both best move and evaluation if current move is not better but as good
+        if eval == self.max_eval:
+            if (self.maximizer and child.skipped_cells > self.n_skipped) or (
+                not self.maximizer and child.skipped_cells < self.n_skipped
+            ):
+                self.best_move = move
+                self.max_eval = eval
+
+
+def lookup(state, memo, stats):
+    """
+    Get the best move and evaluation of a state without searching, if known.
+
+    :param state: The game state.
+    :param memo: The memo of solved states.
+    :param stats: The search counters.
+
+    :return: The best move and evaluation, or None if the state must be searched.
+    """
+
+    stats["nodes"] += 1
 
     if state.is_terminal():
         # Return evaluation for the player at terminal state
         # With negamax there is no distinction between maximizer and minimizer and the evaluation is the same
-        return None, -1, memo
+        return None, -1
+
+    entry = memo.get(state.key)
+    if entry is not None:
+        # Return memoized values, both for winning and losing states
+        # Ties are broken in the same way whatever the path to the state, so memoized moves are exact
+        # Moves are memoized in the orientation of the key, so map them back to the state
+        stats["memo_hits"] += 1
+        return state.orient(entry["move"]), entry["eval"]
+
+    return None
+
+
+def negamax(state, maximizer, memo=None, stats=None):
+    """
+    Solve a state with negamax, exploring the game tree with an explicit stack.
+
+    :param state: The game state.
+    :param maximizer: Whether the player to move is the maximizer.
+    :param memo: The memo of solved states, shared across calls. A BoundedMemo caps its size between searches.
+    :param stats: The search counters, with the number of nodes visited and memo hits.
+
+    :return: The best move, its evaluation and the memo.
+    """
 
     if memo is None:
         # Initialize the memo at first call
@@ -92,41 +328,47 @@ def negamax(state, maximizer, memo=None):
         # Acts as a hash table
         memo = dict()
 
-    if str(state) in memo and memo[str(state)]["eval"] > 0:
-        # Return memoized values if optimized
-        return memo[str(state)]["move"], memo[str(state)]["eval"], memo
+    if stats is None:
+        stats = dict()
+    stats.setdefault("nodes", 0)
+    stats.setdefault("memo_hits", 0)
 
-    # Initialize best evaluation and move
-    best_move = None
-    max_eval = -float("inf")
+    known = lookup(state, memo, stats)
+    if known is not None:
+        return known[0], known[1], memo
 
-    # Initalize count of skipped moves
-    # This is done because if two moves have the same evaluation, another criterion is needed
-    # The maximizer aims to maximize it and the minimizer aims to minimize it
-    n_skipped = -float("inf") if maximizer else +float("inf")
+    # Each frame stands for a state whose children are still being explored
+    stack = [SearchFrame(state, maximizer)]
 
-    for i, j in state.moves:
-        # Call recursion on children to evaluate all possible moves
-        child = state.bite(i, j)
-        _, eval, memo = negamax(child, not maximizer, memo)
-        # Switch sign of the evaluation for current player
-        eval = -eval
+    while True:
+        frame = stack[-1]
 
-        # Update both best move and evaluation if current move is better
-        if eval > max_eval:
-            best_move = (i, j)
-            max_eval = eval
+        if frame.idx < len(frame.moves):
+            # Evaluate the next child, or search it if not known yet
+            move = frame.moves[frame.idx]
+            child = frame.state.bite(*move)
+            known = lookup(child, memo, stats)
 
-        # Update both best move and evaluation if current move is not better but as good
-        if eval == max_eval:
-            if (maximizer and child.skipped_cells > n_skipped) or (
-                not maximizer and child.skipped_cells < n_skipped
-            ):
-                best_move = (i, j)
-                max_eval = eval
+            if known is None:
+                stack.append(SearchFrame(child, not frame.maximizer))
+            else:
+                # Switch sign of the evaluation for current player
+                frame.update(move, child, -known[1])
+                frame.idx += 1
+            continue
+
+        # Store best move and evaluation in memo
+        # This is guaranteed to be the best move and evaluation for the state
+        memo[frame.state.key] = {
+            "move": frame.state.orient(frame.best_move),
+            "eval": frame.max_eval,
+        }
+        stack.pop()
 
-    # Store best move and evaluation in memo
-    # This is guaranteed to be the best move and evaluation for the state
-    memo[str(state)] = {"move": best_move, "eval": max_eval}
+        if not stack:
+            return frame.best_move, frame.max_eval, memo
 
-    return best_move, max_eval, memo
+        # Pass the evaluation back to the parent, as the recursion would return it
+        parent = stack[-1]
+        parent.update(parent.moves[parent.idx], frame.state, -frame.max_eval)
+        parent.idx += 1
@@ -1,8 +1,13 @@
 import streamlit as st
 from src.chomp.chomp_minimax import *
+from src.chomp.chomp_table import ChompTable, load_table
 from time import sleep
 
 
+# Number of states kept by the bot when solving lazily
+BOT_MEMO_SIZE = 50000
+
+
 ### -------------------------------------------------- ###
 ### --- SESSION STATE -------------------------------- ###
 
@@ -10,7 +15,7 @@ from time import sleep
 def init_chomp_state():
     if "chomp" not in st.session_state:
         st.session_state["chomp"] = {
-            "bot_sigma": dict(),
+            "bot_sigma": None,
             "end_game": None,
             "n_rows": 2,
             "n_cols": 2,
@@ -45,16 +50,17 @@ def set_chomp_state(key, val):
 
 def play():
     """
-    Start the game and compute the optimal strategy for the bot.
+    Start the game and load the optimal strategy for the bot.
     Then, let the bot move if necessary.
     """
 
     # Start the game
     st.session_state.chomp["game_on"] = True
 
-    # Compute the optimal strategy
-    _, _, sigma = negamax(st.session_state.chomp["game_state"], True)
-    st.session_state.chomp["bot_sigma"] = sigma
+    # Load the optimal strategy
+    st.session_state.chomp["bot_sigma"] = load_strategy(
+        st.session_state.chomp["n_rows"], st.session_state.chomp["n_cols"]
+    )
 
     # If the user is in position 2, then let the bot move
     if st.session_state.chomp["user"] == 2:
@@ -119,18 +125,50 @@ def move(x, y):
             )
 
 
+@st.cache_resource(show_spinner=False)
+def load_strategy(n_rows, n_cols):
+    """
+    Load the bot's strategy for a board.
+    If the board was precomputed, this is its solution table.
+    Otherwise, this is an empty memo that will be filled lazily as the games go.
+
+    The strategy is cached once per board size and shared by all sessions of the process.
+    Concurrent sessions asking for the same board wait for a single load instead of repeating it.
+
+    :param n_rows: The number of rows of the board.
+    :param n_cols: The number of columns of the board.
+
+    :return: The bot's strategy.
+    """
+
+    # The table is memory-mapped, so no solving nor copying happens here
+    table = load_table(n_rows, n_cols)
+    if table is not None:
+        return table
+
+    return BoundedMemo(BOT_MEMO_SIZE)
+
+
 def bot_action(bot_sigma, state):
     """
     Get the bot's move based on the current state.
 
-    :param bot_sigma: The bot's strategy dictionary.
+    :param bot_sigma: The bot's strategy, either a solution table or a memo.
     :param state: The current game state.
 
     :return: The bot's move
     """
 
     # Return bot's strategy at the given state
-    return bot_sigma[str(state)]["move"]
+    if isinstance(bot_sigma, ChompTable):
+        return bot_sigma.move(state)
+
+    # Otherwise, solve only the subtree under the current state
+    # States solved at previous moves are kept in the memo, so most of them are just looked up
+    # The memo is only trimmed after the search, so the latency is at most a full solve of the subtree
+    with bot_sigma.pinned():
+        move, _, _ = negamax(state, True, memo=bot_sigma)
+    return move
 
 
 def end_game(status):
@@ -0,0 +1,231 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from math import comb
+import argparse
+import mmap
+import os
+
+
+TABLES_DIR = os.path.join(os.path.dirname(__file__), "tables")
+
+# Each entry stores the evaluation and the best bite as a cell index
+ENTRY_SIZE = 2
+
+
+### -------------------------------------------------- ###
+### --- STAIRCASE RANKING ---------------------------- ###
+
+
+@lru_cache(maxsize=None)
+def rank_weights(n_rows, n_cols):
+    """
+    Precompute the weights to rank the positions of a board of the given size.
+    Every Chomp position is a staircase, i.e. a non-increasing sequence of row lengths.
+    Sorting them lexicographically, the rank of a staircase l is the sum of C(n_rows-i-1 + l[i], n_rows-i).
+
+    :param n_rows: The number of rows of the board.
+    :param n_cols: The number of columns of the board.
+
+    :return: A tuple of weights indexed by row and row length.
+    """
+
+    return tuple(
+        tuple(comb(n_rows - i - 1 + x, n_rows - i) for x in range(n_cols + 1))
+        for i in range(n_rows)
+    )
+
+
+def n_positions(n_rows, n_cols):
+    """Count the staircases fitting in the board, the empty one included."""
+    return comb(n_rows + n_cols, n_rows)
+
+
+def rank(state):
+    """
+    Get the rank of a state among all the positions of its board.
+
+    :param state: The game state.
+
+    :return: The index of the state in the solution table.
+    """
+
+    n_cols = state.n_cols
+    row_mask = (1 << n_cols) - 1
+    weights = rank_weights(state.n_rows, n_cols)
+
+    r = 0
+    cells = state.cells
+    for w in weights:
+        # Rows are always filled from the left, so the length of a row is its number of cells
+        r += w[(cells & row_mask).bit_count()]
+        cells >>= n_cols
+
+    return r
+
+
+### -------------------------------------------------- ###
+### --- SOLUTION TABLE ------------------------------- ###
+
+
+class ChompTable:
+
+    def __init__(self, n_rows, n_cols, path=None):
+
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.path = path if path is not None else table_path(n_rows, n_cols)
+
+        # Map the table in memory, so that it is only read when moves are looked up
+        with open(self.path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) != ENTRY_SIZE * n_positions(n_rows, n_cols):
+            raise ValueError(
+                "Invalid table size for a {}x{} board.".format(n_rows, n_cols)
+            )
+
+    def eval(self, state):
+        """Get the evaluation of the state for the player to move."""
+
+        # Evaluations are stored as signed bytes
+        e = self.data[ENTRY_SIZE * rank(state)]
+        return e - 256 if e > 127 else e
+
+    def move(self, state):
+        """Get the best bite at the state."""
+        return divmod(self.data[ENTRY_SIZE * rank(state) + 1], self.n_cols)
+
+
+def table_path(n_rows, n_cols):
+    return os.path.join(TABLES_DIR, "{}x{}.bin".format(n_rows, n_cols))
+
+
+def staircases(n_rows, bound):
+    """
+    Enumerate the staircases of the given number of rows in rank order.
+
+    :param n_rows: The number of rows of the staircase.
+    :param bound: The maximum length of the first row.
+
+    :return: A generator of tuples of row lengths.
+    """
+
+    if n_rows == 0:
+        yield ()
+        return
+
+    for x in range(bound + 1):
+        # The following rows cannot be longer than the current one
+        for rest in staircases(n_rows - 1, x):
+            yield (x,) + rest
+
+
+def build_table(n_rows, n_cols):
+    """
+    Solve a board and store the best move and evaluation of every position in a binary table.
+    This is done bottom-up, because any bite makes a row shorter and hence yields a lower rank.
+    Then, all children of a position are solved before the position itself.
+
+    :param n_rows: The number of rows of the board.
+    :param n_cols: The number of columns of the board.
+
+    :return: The table as bytes.
+    """
+
+    weights = rank_weights(n_rows, n_cols)
+    table = bytearray(ENTRY_SIZE * n_positions(n_rows, n_cols))
+    losing = bytearray(n_positions(n_rows, n_cols))
+
+    # Sum the weights of each column over the first rows
+    # This gives the rank change of a bite in constant time
+    col_weights = [[0] * (n_rows + 1) for _ in range(n_cols + 1)]
+    for c in range(n_cols + 1):
+        for i in range(n_rows):
+            col_weights[c][i + 1] = col_weights[c][i] + weights[i][c]
+
+    # The empty board is never reached, while the player left with the poison cell only has lost
+    losing[1] = 1
+    table[ENTRY_SIZE] = -1 & 0xFF
+
+    for r, rows in enumerate(staircases(n_rows, n_cols)):
+        if r < 2:
+            continue
+
+        # Sum the weights of the current row lengths over the first rows
+        row_weights = [0]
+        for i in range(n_rows):
+            row_weights.append(row_weights[-1] + weights[i][rows[i]])
+
+        # Count the rows reaching each column
+        heights = [sum(l > c for l in rows) for c in range(n_cols)]
+
+        # Look for a bite leaving the opponent in a losing position
+        # Moves are scanned backwards, so that ties keep the last one in row-major order as negamax does
+        best_move = None
+        for i in range(n_rows - 1, -1, -1):
+            for c in range(rows[i] - 1, 0 if i == 0 else -1, -1):
+                h = heights[c]
+                child = r - (row_weights[h] - row_weights[i])
+                child += col_weights[c][h] - col_weights[c][i]
+                if losing[child]:
+                    best_move = i * n_cols + c
+                    break
+            if best_move is not None:
+                break
+
+        if best_move is None:
+            # All bites are losing, so just take the last one
+            losing[r] = 1
+            last = max(i for i in range(n_rows) if rows[i])
+            best_move = last * n_cols + rows[last] - 1
+
+        table[ENTRY_SIZE * r] = (-1 if losing[r] else 1) & 0xFF
+        table[ENTRY_SIZE * r + 1] = best_move
+
+    return bytes(table)
+
+
+def write_table(n_rows, n_cols):
+    """Build the table of a board and save it to the tables folder."""
+
+    os.makedirs(TABLES_DIR, exist_ok=True)
+    with open(table_path(n_rows, n_cols), "wb") as f:
+        f.write(build_table(n_rows, n_cols))
+
+
+def load_table(n_rows, n_cols):
+    """Load the table of a board, or return None if it was never saved."""
+
+    if not os.path.exists(table_path(n_rows, n_cols)):
+        return None
+
+    return ChompTable(n_rows, n_cols)
+
+
+### -------------------------------------------------- ###
+### --- OFFLINE SOLVER ------------------------------- ###
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Precompute the Chomp solution tables."
+    )
+    parser.add_argument("--max-rows", type=int, default=8)
+    parser.add_argument("--max-cols", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    sizes = [
+        (n_rows, n_cols)
+        for n_rows in range(2, args.max_rows + 1)
+        for n_cols in range(2, args.max_cols + 1)
+    ]
+
+    # Boards are independent, so they are solved in parallel
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(write_table, *size) for size in sizes]
+        for size, future in zip(sizes, futures):
+            future.result()
+            print("Saved {}".format(table_path(*size)))
+